@@ -1,23 +1,53 @@
+import asyncio
+import json
 import os
 import subprocess
+import functools
+import concurrent.futures
 from pathlib import Path
 from app.utils import get_video_output_path
+from app.ffmpeg_pool import FFmpegPool
 import logging
 
+try:
+    import av
+except ImportError:
+    # PyAV is optional; probing falls back to spawning ffprobe
+    av = None
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; the stdlib parser handles the small probe payloads
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 logger = logging.getLogger(__name__)
 
-def get_video_info(input_path: str) -> dict:
-    """Get video information using ffprobe"""
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries", "stream=codec_name,width,height,r_frame_rate",
-        "-show_entries", "format=duration,bit_rate",
-        "-of", "json",
-        input_path
-    ]
-    
+# Hardware H.264 encoders in preference order (NVIDIA, AMD, Intel, Apple)
+HW_ENCODERS = ["h264_nvenc", "h264_amf", "h264_qsv", "h264_videotoolbox"]
+
+# Segment length for chunked parallel encoding, and the input duration below
+# which the split/concat overhead outweighs the parallel speedup
+CHUNK_SECONDS = 4
+CHUNKED_MIN_DURATION = 60
+
+# Static argument blocks shared by the encode commands, built once at import
+MAP_ARGS = ("-map", "0:v:0", "-map", "0:a:0?", "-sn", "-dn")
+AUDIO_ARGS = ("-c:a", "aac", "-b:a", "128k", "-ar", "44100", "-ac", "2")
+
+# Pin x264 thread counts instead of trusting its auto-detection: a lone
+# encode gets every core, while the chunked path runs cpu_count encodes at
+# once so each gets a small fixed share to avoid oversubscription
+CPU_COUNT = os.cpu_count() or 1
+CHUNK_THREADS = 2 if CPU_COUNT > 1 else 1
+
+@functools.lru_cache(maxsize=1)
+def _detect_hwaccel() -> list:
+    """Detect hardware decode support, returning ffmpeg args to enable it"""
+    cmd = ["ffmpeg", "-hide_banner", "-hwaccels"]
+
     try:
         result = subprocess.run(
             cmd,
@@ -25,21 +55,39 @@ def get_video_info(input_path: str) -> dict:
             text=True,
             check=True
         )
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFprobe error: {e.stderr}")
-        raise RuntimeError(f"Failed to get video information: {e.stderr}")
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logger.warning("Hardware decoder detection failed, decoding on CPU: %s", e)
+        return []
+
+    # First line of output is the "Hardware acceleration methods:" header
+    methods = [line.strip() for line in result.stdout.splitlines()[1:] if line.strip()]
+    if methods:
+        logger.info("Hardware decode available: %s", ', '.join(methods))
+        return ["-hwaccel", "auto"]
+
+    logger.info("No hardware decoder available, decoding on CPU")
+    return []
 
-def get_video_duration(input_path: str) -> float:
-    """Get video duration in seconds using ffprobe"""
+def _hw_encoder_works(encoder: str) -> bool:
+    """Verify an encoder can open real hardware with a one-frame test encode"""
     cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        input_path
+        "ffmpeg", "-hide_banner", "-v", "error",
+        "-f", "lavfi", "-i", "color=black:s=64x64:d=0.1",
+        "-c:v", encoder,
+        "-f", "null", "-"
     ]
-    
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return False
+    return result.returncode == 0
+
+@functools.lru_cache(maxsize=1)
+def _detect_hw_encoder() -> str:
+    """Detect the best usable hardware H.264 encoder, empty string if none"""
+    cmd = ["ffmpeg", "-hide_banner", "-encoders"]
+
     try:
         result = subprocess.run(
             cmd,
@@ -47,104 +95,568 @@ def get_video_duration(input_path: str) -> float:
             text=True,
             check=True
         )
-        return float(result.stdout.strip())
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFprobe error: {e.stderr}")
-        raise RuntimeError(f"Failed to get video duration: {e.stderr}")
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logger.warning("Hardware encoder detection failed, using software encoding: %s", e)
+        return ""
+
+    for encoder in HW_ENCODERS:
+        if encoder not in result.stdout:
+            continue
+        # Being listed only proves the encoder was compiled into the build;
+        # distro ffmpeg lists h264_nvenc on GPU-less hosts too. Only select
+        # encoders that survive an actual test encode.
+        if _hw_encoder_works(encoder):
+            logger.info("Using hardware encoder: %s", encoder)
+            return encoder
+        logger.info("Encoder %s is built in but has no usable hardware", encoder)
+
+    logger.info("No hardware encoder available, using libx264")
+    return ""
+
+async def _run_command(cmd: list) -> tuple:
+    """Run a command without blocking the event loop, return (returncode, stdout, stderr)"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    return proc.returncode, stdout.decode(), stderr.decode()
+
+# Shared worker pool for ffmpeg jobs, started from the app lifecycle hooks.
+# Probes stay outside the pool so they never queue behind long encodes.
+ffmpeg_pool = FFmpegPool()
 
-def get_video_bitrate(input_path: str) -> int:
-    """Get video bitrate in bits per second using ffprobe"""
+async def _run_ffmpeg(cmd: list) -> tuple:
+    """Run an ffmpeg job through the pool, or directly before the pool starts"""
+    if ffmpeg_pool.running:
+        return await ffmpeg_pool.submit(cmd)
+    return await _run_command(cmd)
+
+# Single long-lived worker thread for in-process probes. ffprobe has no
+# persistent mode - it probes exactly one input per invocation - so the
+# daemon-style amortization happens here instead: libavformat stays loaded
+# and warm in this thread for the life of the process, and probes never
+# queue behind large file reads on the default executor.
+_probe_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="probe"
+)
+
+# Parsed probe results keyed by (path, mtime_ns, size) so repeat lookups
+# on the same file skip the ffprobe process spawn entirely; per-path locks
+# collapse concurrent probes of the same file into one spawn
+_probe_cache = {}
+_probe_locks = {}
+
+def purge_probe_cache(path_prefix: str):
+    """Drop cached probe results for files under a removed directory"""
+    for key in [k for k in _probe_cache if k[0].startswith(path_prefix)]:
+        del _probe_cache[key]
+    for path in [p for p in _probe_locks if p.startswith(path_prefix)]:
+        del _probe_locks[path]
+
+def _probe_in_process(input_path: str) -> dict:
+    """Read container metadata via PyAV, shaped like the ffprobe JSON output"""
+    with av.open(input_path) as container:
+        if container.duration is None or container.bit_rate is None:
+            raise ValueError("container is missing duration or bit_rate")
+
+        info = {
+            "format": {
+                "duration": f"{container.duration / av.time_base:.6f}",
+                "bit_rate": str(container.bit_rate)
+            }
+        }
+        streams = []
+        if container.streams.video:
+            codec = container.streams.video[0].codec_context
+            streams.append({
+                "codec_type": "video",
+                "codec_name": codec.name,
+                "width": codec.width,
+                "height": codec.height,
+                "r_frame_rate": str(container.streams.video[0].average_rate)
+            })
+        if container.streams.audio:
+            streams.append({
+                "codec_type": "audio",
+                "codec_name": container.streams.audio[0].codec_context.name
+            })
+        if streams:
+            info["streams"] = streams
+        return info
+
+async def _probe_subprocess(input_path: str) -> dict:
+    """Get video information by spawning ffprobe"""
     cmd = [
         "ffprobe",
         "-v", "error",
-        "-show_entries", "format=bit_rate",
-        "-of", "default=noprint_wrappers=1:nokey=1",
+        "-show_entries", "stream=codec_type,codec_name,width,height,r_frame_rate",
+        "-show_entries", "format=duration,bit_rate",
+        "-of", "json",
         input_path
     ]
-    
-    try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return int(result.stdout.strip())
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFprobe error: {e.stderr}")
-        raise RuntimeError(f"Failed to get video bitrate: {e.stderr}")
+
+    returncode, stdout, stderr = await _run_command(cmd)
+    if returncode != 0:
+        logger.error("FFprobe error: %s", stderr)
+        raise RuntimeError(f"Failed to get video information: {stderr}")
+
+    return _json_loads(stdout)
+
+async def get_video_info(input_path: str) -> dict:
+    """Get video information as a parsed dict"""
+    stat = os.stat(input_path)
+    cache_key = (input_path, stat.st_mtime_ns, stat.st_size)
+    if cache_key in _probe_cache:
+        return _probe_cache[cache_key]
+
+    lock = _probe_locks.setdefault(input_path, asyncio.Lock())
+    async with lock:
+        # Another task may have probed this file while we waited
+        if cache_key in _probe_cache:
+            return _probe_cache[cache_key]
+
+        info = None
+        if av is not None:
+            # libavformat reads the header fields in-process in ~1 ms versus
+            # ~100 ms for an ffprobe fork/exec; run in an executor since
+            # av.open performs synchronous IO
+            try:
+                info = await asyncio.get_running_loop().run_in_executor(
+                    _probe_executor, _probe_in_process, input_path
+                )
+            except Exception as e:
+                logger.warning("PyAV probe failed, falling back to ffprobe: %s", e)
+
+        if info is None:
+            info = await _probe_subprocess(input_path)
+
+        _probe_cache[cache_key] = info
+        return info
 
 async def compress_video(
     input_path: str,
     target_size_mb: float,
-    maintain_aspect_ratio: bool
+    maintain_aspect_ratio: bool,
+    strict_size: bool = False
 ) -> str:
     """Compress video to target size using FFmpeg"""
     # Get video information
-    video_info = get_video_info(input_path)
-    logger.info(f"Video information: {video_info}")
-    
+    video_info = await get_video_info(input_path)
+    logger.info("Video information: %s", video_info)
+
     # Calculate target bitrate
-    duration = get_video_duration(input_path)
+    duration = float(video_info["format"]["duration"])
     target_size_bits = target_size_mb * 8 * 1024 * 1024
     target_bitrate = int(target_size_bits / duration)
     
     job_id = str(Path(input_path).parent.name)
     output_path = get_video_output_path(input_path, job_id)
-    
-    # Build FFmpeg command with improved codec selection
-    base_cmd = [
+
+    # Use a hardware encoder when one is available - the fixed-function ASIC
+    # encodes an order of magnitude faster than libx264 and needs no first pass
+    hw_encoder = _detect_hw_encoder()
+    if hw_encoder:
+        try:
+            return await _compress_video_hw(
+                input_path, output_path, hw_encoder, target_bitrate, maintain_aspect_ratio
+            )
+        except RuntimeError as e:
+            # Detection ran a test encode, but the hardware can still fail
+            # later (driver update, GPU contention); finish the job on CPU
+            logger.warning("Hardware encode failed, falling back to libx264: %s", e)
+
+    # A hard size target needs real two-pass rate control; everything else
+    # gets the cheaper single-pass capped-CRF encode
+    if strict_size:
+        return await _compress_video_two_pass(
+            input_path, output_path, target_bitrate, maintain_aspect_ratio
+        )
+
+    # Long inputs are split into chunks and encoded in parallel so a serial
+    # software encode doesn't leave N-1 cores idle
+    if duration >= CHUNKED_MIN_DURATION:
+        has_audio = any(
+            s.get("codec_type") == "audio" for s in video_info.get("streams", [])
+        )
+        return await compress_video_chunked(
+            input_path, output_path, target_bitrate, maintain_aspect_ratio, has_audio
+        )
+
+    # Single-pass capped-CRF encode: CRF picks quality, maxrate/bufsize cap
+    # the bitrate so the output stays near the target size without the cost
+    # of a separate analysis pass
+    cmd = [
         "ffmpeg",
+        *_detect_hwaccel(),  # Decode on GPU when the host has one
         "-i", input_path,
+        *MAP_ARGS,
         "-c:v", "libx264",  # Use H.264 codec
         "-preset", "medium",  # Balance between speed and quality
         "-crf", "23",  # Constant Rate Factor for quality
-        "-b:v", f"{target_bitrate}",
-        "-maxrate", f"{target_bitrate * 1.5}",  # Maximum bitrate
+        "-maxrate", f"{target_bitrate}",  # Cap bitrate at the size target
         "-bufsize", f"{target_bitrate * 2}",  # Buffer size
-        "-pass", "1",
-        "-f", "mp4"
+        *AUDIO_ARGS,
+        "-movflags", "+faststart",
+        "-threads", f"{CPU_COUNT}"
     ]
-    
+
     if maintain_aspect_ratio:
-        base_cmd.extend(["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"])
-    
-    # First pass
-    first_pass = base_cmd + ["-y", "NUL"]
+        cmd.extend(["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"])
+
+    cmd.extend(["-y", output_path])
+
+    logger.info("Starting encoding")
+    returncode, _, stderr = await _run_ffmpeg(cmd)
+    if returncode != 0:
+        logger.error("Encoding failed: %s", stderr)
+        raise RuntimeError(f"Encoding failed: {stderr}")
+
+    return output_path
+
+async def compress_video_chunked(
+    input_path: str,
+    output_path: str,
+    target_bitrate: int,
+    maintain_aspect_ratio: bool,
+    has_audio: bool
+) -> str:
+    """Compress video by encoding keyframe-aligned chunks in parallel"""
+    chunk_dir = Path(output_path).parent / "chunks"
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+
+    # Split the video stream on keyframes without re-encoding. Audio is kept
+    # out of the chunks: independently encoded AAC segments carry priming
+    # samples that click at every boundary and drift A/V sync, so the audio
+    # is encoded once over the full input and muxed back in at concat time
+    segment_cmd = [
+        "ffmpeg",
+        "-i", input_path,
+        "-map", "0:v:0",
+        "-an", "-sn", "-dn",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(CHUNK_SECONDS),
+        "-reset_timestamps", "1",
+        "-y", str(chunk_dir / "%04d.mp4")
+    ]
+
+    logger.info("Segmenting input for chunked encoding")
+    returncode, _, stderr = await _run_ffmpeg(segment_cmd)
+    if returncode != 0:
+        logger.error("Segmenting failed: %s", stderr)
+        raise RuntimeError(f"Segmenting failed: {stderr}")
+
+    chunks = sorted(chunk_dir.glob("[0-9]*.mp4"))
+    if not chunks:
+        raise RuntimeError("Segmenting produced no chunks")
+
+    # Each chunk gets the same single-pass capped-CRF encode as the short
+    # path: every chunk is held to the same rate cap, so the concatenated
+    # output lands on the same size as a serial encode would
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+
+    async def encode_chunk(chunk: Path) -> Path:
+        encoded_path = chunk.with_name(f"enc_{chunk.name}")
+        cmd = [
+            "ffmpeg",
+            "-i", str(chunk),
+            "-map", "0:v:0",
+            "-an", "-sn", "-dn",
+            "-c:v", "libx264",
+            "-preset", "medium",
+            "-crf", "23",
+            "-maxrate", f"{target_bitrate}",
+            "-bufsize", f"{target_bitrate * 2}",
+            "-threads", f"{CHUNK_THREADS}"
+        ]
+        if maintain_aspect_ratio:
+            cmd.extend(["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"])
+        cmd.extend(["-y", str(encoded_path)])
+
+        async with semaphore:
+            returncode, _, stderr = await _run_ffmpeg(cmd)
+        if returncode != 0:
+            logger.error("Chunk encoding failed: %s", stderr)
+            raise RuntimeError(f"Chunk encoding failed: {stderr}")
+        return encoded_path
+
+    async def encode_audio() -> Path:
+        audio_path = chunk_dir / "audio.m4a"
+        cmd = [
+            "ffmpeg",
+            "-i", input_path,
+            "-map", "0:a:0",
+            "-vn", "-sn", "-dn",
+            *AUDIO_ARGS,
+            "-y", str(audio_path)
+        ]
+        returncode, _, stderr = await _run_ffmpeg(cmd)
+        if returncode != 0:
+            logger.error("Audio encoding failed: %s", stderr)
+            raise RuntimeError(f"Audio encoding failed: {stderr}")
+        return audio_path
+
+    # The probe already told us whether an audio stream exists, so a failed
+    # audio encode is a real error rather than something to swallow
+    logger.info("Encoding %s chunks in parallel", len(chunks))
+    chunk_tasks = [asyncio.create_task(encode_chunk(c)) for c in chunks]
+    audio_task = asyncio.create_task(encode_audio()) if has_audio else None
+    all_tasks = chunk_tasks + ([audio_task] if audio_task else [])
+
     try:
-        logger.info("Starting first pass encoding")
-        subprocess.run(first_pass, capture_output=True, check=True)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"First pass encoding failed: {e.stderr}")
-        raise RuntimeError(f"First pass encoding failed: {e.stderr}")
-    
-    # Second pass with improved audio handling
+        await asyncio.gather(*all_tasks)
+    except Exception:
+        # Cancel the surviving encodes before the error reaches cleanup,
+        # which removes the directory they are still writing into
+        for task in all_tasks:
+            task.cancel()
+        await asyncio.gather(*all_tasks, return_exceptions=True)
+        raise
+
+    encoded_chunks = [task.result() for task in chunk_tasks]
+    audio_path = audio_task.result() if audio_task else None
+
+    # Stitch the encoded chunks back together without re-encoding and mux
+    # the single audio track in alongside
+    list_path = chunk_dir / "list.txt"
+    list_path.write_text("".join(f"file '{p.name}'\n" for p in encoded_chunks))
+
+    concat_cmd = [
+        "ffmpeg",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", str(list_path)
+    ]
+    if audio_path is not None:
+        concat_cmd.extend(["-i", str(audio_path), "-map", "0:v:0", "-map", "1:a:0"])
+    concat_cmd.extend([
+        "-c", "copy",
+        "-movflags", "+faststart",
+        "-y", output_path
+    ])
+
+    logger.info("Concatenating encoded chunks")
+    returncode, _, stderr = await _run_ffmpeg(concat_cmd)
+    if returncode != 0:
+        logger.error("Concat failed: %s", stderr)
+        raise RuntimeError(f"Concat failed: {stderr}")
+
+    return output_path
+
+async def _compress_video_two_pass(
+    input_path: str,
+    output_path: str,
+    target_bitrate: int,
+    maintain_aspect_ratio: bool,
+    threads: int = CPU_COUNT
+) -> str:
+    """Two-pass ABR encode for hard target sizes"""
+    # Derive the log name from the output so parallel chunk encodes
+    # sharing a directory don't clobber each other's stats
+    passlog = str(Path(output_path).with_suffix("")) + "_2pass"
+
+    # Pass 1 only collects rate-distortion stats: skip audio and discard
+    # the output. The preset must match pass 2 - x264 records encoder
+    # options (weightp, bframes, ...) in the stats header and refuses to
+    # start pass 2 if they differ
+    first_pass = [
+        "ffmpeg",
+        *_detect_hwaccel(),
+        "-i", input_path,
+        "-map", "0:v:0",  # Pass 1 needs only the video stream
+        "-sn", "-dn",
+        "-c:v", "libx264",
+        "-preset", "medium",
+        "-b:v", f"{target_bitrate}",
+        "-an",  # Pass 1 needs no audio
+        "-threads", f"{threads}",
+        "-pass", "1",
+        "-passlogfile", passlog,
+        "-f", "null"
+    ]
+
+    if maintain_aspect_ratio:
+        first_pass.extend(["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"])
+
+    first_pass.extend(["-y", os.devnull])
+
+    logger.info("Starting first pass encoding")
+    returncode, _, stderr = await _run_ffmpeg(first_pass)
+    if returncode != 0:
+        logger.error("First pass encoding failed: %s", stderr)
+        raise RuntimeError(f"First pass encoding failed: {stderr}")
+
     second_pass = [
         "ffmpeg",
+        *_detect_hwaccel(),
         "-i", input_path,
+        *MAP_ARGS,
         "-c:v", "libx264",
         "-preset", "medium",
-        "-crf", "23",
         "-b:v", f"{target_bitrate}",
-        "-maxrate", f"{target_bitrate * 1.5}",
+        "-maxrate", f"{int(target_bitrate * 1.5)}",
         "-bufsize", f"{target_bitrate * 2}",
+        "-threads", f"{threads}",
         "-pass", "2",
-        "-c:a", "aac",  # Use AAC for audio
-        "-b:a", "128k",  # Audio bitrate
-        "-ar", "44100",  # Audio sample rate
-        "-ac", "2"  # Stereo audio
+        "-passlogfile", passlog,
+        *AUDIO_ARGS,
+        "-movflags", "+faststart"
     ]
-    
+
     if maintain_aspect_ratio:
         second_pass.extend(["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"])
-    
+
     second_pass.extend(["-y", output_path])
-    
-    try:
-        logger.info("Starting second pass encoding")
-        subprocess.run(second_pass, capture_output=True, check=True)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Second pass encoding failed: {e.stderr}")
-        raise RuntimeError(f"Second pass encoding failed: {e.stderr}")
-    
-    return output_path 
\ No newline at end of file
+
+    logger.info("Starting second pass encoding")
+    returncode, _, stderr = await _run_ffmpeg(second_pass)
+    if returncode != 0:
+        logger.error("Second pass encoding failed: %s", stderr)
+        raise RuntimeError(f"Second pass encoding failed: {stderr}")
+
+    return output_path
+
+async def _compress_video_hw(
+    input_path: str,
+    output_path: str,
+    encoder: str,
+    target_bitrate: int,
+    maintain_aspect_ratio: bool
+) -> str:
+    """Compress video in a single pass using a hardware encoder"""
+    cmd = ["ffmpeg"]
+
+    if encoder == "h264_nvenc":
+        # Keep decode on the GPU so frames never round-trip through system RAM
+        cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+
+    cmd.extend(["-i", input_path, *MAP_ARGS, "-c:v", encoder])
+
+    if encoder == "h264_nvenc":
+        cmd.extend(["-preset", "p4", "-rc", "vbr"])
+    elif encoder == "h264_amf":
+        cmd.extend(["-usage", "transcoding", "-quality", "balanced", "-rc", "vbr_peak"])
+
+    cmd.extend([
+        "-b:v", f"{target_bitrate}",
+        "-maxrate", f"{int(target_bitrate * 1.5)}",
+        "-bufsize", f"{target_bitrate * 2}",
+        *AUDIO_ARGS,
+        "-movflags", "+faststart"
+    ])
+
+    if maintain_aspect_ratio:
+        if encoder == "h264_nvenc":
+            # Software scale filters can't touch CUDA frames
+            cmd.extend(["-vf", "scale_cuda=trunc(iw/2)*2:trunc(ih/2)*2"])
+        else:
+            cmd.extend(["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"])
+
+    cmd.extend(["-y", output_path])
+
+    logger.info("Starting hardware encoding with %s", encoder)
+    returncode, _, stderr = await _run_ffmpeg(cmd)
+    if returncode != 0:
+        logger.error("Hardware encoding failed: %s", stderr)
+        raise RuntimeError(f"Hardware encoding failed: {stderr}")
+
+    return output_path
+
+async def compress_video_stream(
+    input_path: str,
+    target_size_mb: float,
+    maintain_aspect_ratio: bool
+):
+    """Encode to fragmented MP4 on stdout, returning an async byte generator.
+
+    Fragmented MP4 needs no trailing moov atom, so the response can start
+    the moment the first fragment is encoded instead of after the whole
+    file is written. Single pass only: two-pass rate control is
+    incompatible with streaming the output as it is produced.
+
+    Probing and spawning the encoder happen here, before the caller builds
+    its response, so a bad input still surfaces as an HTTP error instead
+    of a 200 with a truncated body.
+    """
+    video_info = await get_video_info(input_path)
+    duration = float(video_info["format"]["duration"])
+    target_bitrate = int(target_size_mb * 8 * 1024 * 1024 / duration)
+
+    hw_encoder = _detect_hw_encoder()
+    cmd = ["ffmpeg"]
+    if hw_encoder == "h264_nvenc":
+        cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+    else:
+        cmd.extend(_detect_hwaccel())
+
+    cmd.extend(["-i", input_path, *MAP_ARGS])
+
+    if hw_encoder:
+        cmd.extend(["-c:v", hw_encoder])
+        if hw_encoder == "h264_nvenc":
+            cmd.extend(["-preset", "p4", "-rc", "vbr"])
+        elif hw_encoder == "h264_amf":
+            cmd.extend(["-usage", "transcoding", "-quality", "balanced", "-rc", "vbr_peak"])
+        cmd.extend(["-b:v", f"{target_bitrate}"])
+    else:
+        cmd.extend([
+            "-c:v", "libx264", "-preset", "medium", "-crf", "23",
+            "-threads", f"{CPU_COUNT}",
+            # Slice threading and short lookahead keep the first fragments
+            # flowing instead of buffering frames for pipelining
+            "-x264-params", "sliced-threads=1:sync-lookahead=0:rc-lookahead=10"
+        ])
+
+    cmd.extend([
+        "-maxrate", f"{target_bitrate}",
+        "-bufsize", f"{target_bitrate * 2}",
+        *AUDIO_ARGS
+    ])
+
+    if maintain_aspect_ratio:
+        if hw_encoder == "h264_nvenc":
+            cmd.extend(["-vf", "scale_cuda=trunc(iw/2)*2:trunc(ih/2)*2"])
+        else:
+            cmd.extend(["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"])
+
+    cmd.extend([
+        "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4",
+        "pipe:1"
+    ])
+
+    logger.info("Starting streaming encode")
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+    # Read the first chunk before handing back the generator: an encoder
+    # that dies on startup (bad arguments, lost hardware) would otherwise
+    # surface as a 200 with an empty body instead of an error status
+    first_chunk = await proc.stdout.read(65536)
+    if not first_chunk:
+        await proc.wait()
+        logger.error("Streaming encode produced no output, exit code %s", proc.returncode)
+        raise RuntimeError(
+            f"Streaming encode failed to start (exit code {proc.returncode})"
+        )
+
+    async def stream():
+        try:
+            yield first_chunk
+            while chunk := await proc.stdout.read(65536):
+                yield chunk
+            await proc.wait()
+            # Headers are long gone by now, so a failure can only be logged
+            if proc.returncode != 0:
+                logger.error("Streaming encode exited with code %s", proc.returncode)
+        finally:
+            if proc.returncode is None:
+                # Client disconnected mid-stream; don't leave the encoder running
+                proc.kill()
+
+    return stream()
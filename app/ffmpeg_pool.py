@@ -0,0 +1,87 @@
+import asyncio
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class FFmpegPool:
+    """Bounded pool of FFmpeg worker slots shared by all requests.
+
+    FFmpeg handles exactly one job per invocation, so the pool cannot keep a
+    single encoder process alive across jobs; instead it keeps a fixed set of
+    worker tasks draining a shared queue, which caps the number of encoder
+    processes at pool size no matter how many requests are in flight and
+    keeps an overloaded host from thrashing between too many encoders.
+    """
+
+    def __init__(self, size: int = None):
+        self._size = size or os.cpu_count() or 1
+        self._queue = asyncio.Queue()
+        self._workers = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        """Spawn the worker tasks; must be called from a running event loop"""
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self._size)
+        ]
+        logger.info("Started FFmpeg pool with %s workers", self._size)
+
+    async def stop(self):
+        """Cancel the worker tasks and wait for them to finish"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Stopped FFmpeg pool")
+
+    async def submit(self, cmd: list) -> tuple:
+        """Queue a command and wait for (returncode, stdout, stderr)"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((cmd, future))
+        return await future
+
+    async def _worker(self):
+        while True:
+            cmd, future = await self._queue.get()
+            if future.cancelled():
+                # Submitter gave up while the job was still queued
+                self._queue.task_done()
+                continue
+            proc = None
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                # Watch the submitter's future alongside the process: if the
+                # submitter is cancelled mid-run, kill the process instead of
+                # leaving it to write into a directory cleanup may remove
+                communicate = asyncio.ensure_future(proc.communicate())
+                await asyncio.wait(
+                    {communicate, future}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if future.cancelled() and proc.returncode is None:
+                    proc.kill()
+                stdout, stderr = await communicate
+                if not future.done():
+                    future.set_result(
+                        (proc.returncode, stdout.decode(), stderr.decode())
+                    )
+            except asyncio.CancelledError:
+                if proc is not None and proc.returncode is None:
+                    proc.kill()
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
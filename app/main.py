@@ -1,10 +1,18 @@
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
-from fastapi.responses import Response, HTMLResponse
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import os
 import logging
-from app.ffmpeg_handler import compress_video
-from app.utils import save_blob_file, cleanup_temp_files, read_file_as_bytes
+from app.ffmpeg_handler import (
+    compress_video,
+    compress_video_stream,
+    ffmpeg_pool,
+    _detect_hw_encoder,
+    _detect_hwaccel,
+)
+from app.utils import save_blob_file, cleanup_temp_files
 import uuid
 import sys
 
@@ -40,6 +48,19 @@ async def add_security_headers(request: Request, call_next):
     response.headers["X-XSS-Protection"] = "1; mode=block"
     return response
 
+@app.on_event("startup")
+async def start_ffmpeg_pool():
+    # Run the blocking capability probes now, while no requests are in
+    # flight, so their caches are warm before the first upload hits the
+    # event loop
+    _detect_hw_encoder()
+    _detect_hwaccel()
+    ffmpeg_pool.start()
+
+@app.on_event("shutdown")
+async def stop_ffmpeg_pool():
+    await ffmpeg_pool.stop()
+
 # Supported video formats
 SUPPORTED_FORMATS = {
     'video/mp4': '.mp4',
@@ -81,87 +102,153 @@ async def get_upload_form():
                     <label for="maintain_aspect_ratio">Maintain aspect ratio:</label>
                     <input type="checkbox" id="maintain_aspect_ratio" name="maintain_aspect_ratio" checked>
                 </p>
+                <p>
+                    <label for="strict_size">Strict target size (slower):</label>
+                    <input type="checkbox" id="strict_size" name="strict_size">
+                </p>
+                <p>
+                    <label for="stream">Stream result while encoding:</label>
+                    <input type="checkbox" id="stream" name="stream">
+                </p>
                 <input type="submit" value="Compress Video">
             </form>
         </body>
     </html>
     """
 
+# Magic-byte signatures for the supported containers; the client-supplied
+# content type and filename are both spoofable, the file header is not
+def _has_video_signature(head: bytes) -> bool:
+    if len(head) < 12:
+        return False
+    if head[4:8] == b"ftyp":  # MP4, MOV, M4V, 3GP
+        return True
+    if head[:4] == b"\x1a\x45\xdf\xa3":  # Matroska / WebM EBML header
+        return True
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return True
+    if head[:3] == b"FLV":
+        return True
+    if head[:8] == b"\x30\x26\xb2\x75\x8e\x66\xcf\x11":  # ASF (WMV)
+        return True
+    if head[:3] == b"\x00\x00\x01" and head[3] in (0xBA, 0xB3):  # MPEG-PS
+        return True
+    return False
+
 @app.post("/compress-mp4")
 async def compress_video_endpoint(
     video: UploadFile = File(...),
     target_size_mb: float = Form(8.0),
-    maintain_aspect_ratio: bool = Form(True)
+    maintain_aspect_ratio: bool = Form(True),
+    strict_size: bool = Form(False),
+    stream: bool = Form(False)
 ):
+    # Check if the file type is supported
+    if video.content_type not in SUPPORTED_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type. Supported formats are: {', '.join(ext for ext in SUPPORTED_FORMATS.values())}"
+        )
+
+    # Cheap constant-time check on the file header so malformed uploads are
+    # rejected before they cost any disk IO or an ffmpeg spawn
+    head = await video.read(16)
+    await video.seek(0)
+    if not _has_video_signature(head):
+        raise HTTPException(
+            status_code=415,
+            detail="File content does not match a supported video container"
+        )
+
+    logger.info("Processing video: %s", video.filename)
+    logger.info("Target size: %sMB, Maintain aspect ratio: %s", target_size_mb, maintain_aspect_ratio)
+
+    # Generate unique ID for this compression job
+    job_id = str(uuid.uuid4())
+    logger.info("Job ID: %s", job_id)
+
     try:
-        # Check if the file type is supported
-        if video.content_type not in SUPPORTED_FORMATS:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file type. Supported formats are: {', '.join(ext for ext in SUPPORTED_FORMATS.values())}"
-            )
-        
-        logger.info(f"Processing video: {video.filename}")
-        logger.info(f"Target size: {target_size_mb}MB, Maintain aspect ratio: {maintain_aspect_ratio}")
-        
-        # Generate unique ID for this compression job
-        job_id = str(uuid.uuid4())
-        logger.info(f"Job ID: {job_id}")
-        
         try:
-            # Read the file content
-            content = await video.read()
-            if not content:
+            # Stream upload to a temporary file without buffering it in memory
+            input_path = await save_blob_file(video, job_id)
+            if os.path.getsize(input_path) == 0:
                 raise HTTPException(status_code=400, detail="No file content provided")
-            
-            logger.info(f"File size before compression: {len(content) / (1024*1024):.2f}MB")
-            
-            # Save blob to temporary file
-            input_path = await save_blob_file(content, job_id)
-            logger.info(f"Saved input file to: {input_path}")
+
+            logger.info("File size before compression: %.2fMB", os.path.getsize(input_path) / (1024*1024))
+            logger.info("Saved input file to: %s", input_path)
             
             # Check if ffmpeg is available
-            if not os.system("ffmpeg -version") == 0:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    "ffmpeg", "-version",
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL
+                )
+                ffmpeg_available = await proc.wait() == 0
+            except FileNotFoundError:
+                ffmpeg_available = False
+            if not ffmpeg_available:
                 raise HTTPException(status_code=500, detail="FFmpeg is not installed or not available in PATH")
             
+            # Stream the encoder output straight to the client as fragmented
+            # MP4; time-to-first-byte becomes milliseconds instead of the
+            # full encode time. Streaming is single-pass, so strict_size
+            # does not apply here. The probe and encoder spawn happen in the
+            # await, so bad inputs fail with an error status rather than a
+            # 200 that cuts off mid-body.
+            if stream:
+                encoded_stream = await compress_video_stream(
+                    input_path, target_size_mb, maintain_aspect_ratio
+                )
+                return StreamingResponse(
+                    encoded_stream,
+                    media_type="video/mp4",
+                    headers={
+                        "Content-Disposition": f'attachment; filename="compressed_{os.path.splitext(video.filename)[0]}.mp4"'
+                    },
+                    background=BackgroundTask(cleanup_temp_files, job_id)
+                )
+
             # Compress the video
             output_path = await compress_video(
                 input_path,
                 target_size_mb,
-                maintain_aspect_ratio
+                maintain_aspect_ratio,
+                strict_size
             )
-            logger.info(f"Compression complete. Output file: {output_path}")
-            
-            # Read the compressed file as bytes
-            compressed_content = await read_file_as_bytes(output_path)
-            logger.info(f"File size after compression: {len(compressed_content) / (1024*1024):.2f}MB")
-            
-            # Return the compressed file as binary response
-            return Response(
-                content=compressed_content,
+            logger.info("Compression complete. Output file: %s", output_path)
+            logger.info("File size after compression: %.2fMB", os.path.getsize(output_path) / (1024*1024))
+
+            # Hand the file descriptor to the server so the kernel streams it
+            # straight to the socket; the temp files are removed once the
+            # client has finished downloading
+            return FileResponse(
+                output_path,
                 media_type="video/mp4",  # Always return as MP4
-                headers={
-                    "Content-Disposition": f'attachment; filename="compressed_{os.path.splitext(video.filename)[0]}.mp4"'
-                }
+                filename=f"compressed_{os.path.splitext(video.filename)[0]}.mp4",
+                background=BackgroundTask(cleanup_temp_files, job_id)
             )
-        
+
         except FileNotFoundError as e:
-            logger.error(f"File not found error: {str(e)}")
+            logger.error("File not found error: %s", str(e))
             raise HTTPException(status_code=500, detail=f"File operation failed: {str(e)}")
         except PermissionError as e:
-            logger.error(f"Permission error: {str(e)}")
+            logger.error("Permission error: %s", str(e))
             raise HTTPException(status_code=500, detail=f"Permission denied: {str(e)}")
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"Unexpected error during processing: {str(e)}", exc_info=True)
+            logger.error("Unexpected error during processing: %s", str(e), exc_info=True)
             raise HTTPException(status_code=500, detail=f"Video processing failed: {str(e)}")
-        
-    finally:
-        # Cleanup temporary files
+
+    except Exception:
+        # On failure the response never streams, so cleanup happens here
         try:
             await cleanup_temp_files(job_id)
-            logger.info(f"Cleaned up temporary files for job {job_id}")
+            logger.info("Cleaned up temporary files for job %s", job_id)
         except Exception as e:
-            logger.error(f"Error during cleanup: {str(e)}")
+            logger.error("Error during cleanup: %s", str(e))
+        raise
 
 @app.get("/health")
 async def health_check():
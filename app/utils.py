@@ -2,31 +2,34 @@ import os
 import shutil
 from pathlib import Path
 import aiofiles
+from fastapi import UploadFile
 
 TEMP_DIR = Path(__file__).parent / "temp"
 
-async def save_blob_file(content: bytes, job_id: str) -> str:
-    """Save binary content to temporary directory"""
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+async def save_blob_file(upload: UploadFile, job_id: str) -> str:
+    """Stream an uploaded file to the temporary directory in fixed-size chunks"""
     # Create job directory
     job_dir = TEMP_DIR / job_id
     job_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Save file
+
+    # Stream to disk so memory stays constant regardless of upload size
     file_path = job_dir / f"input.mp4"
     async with aiofiles.open(file_path, "wb") as buffer:
-        await buffer.write(content)
-    
-    return str(file_path)
+        while chunk := await upload.read(CHUNK_SIZE):
+            await buffer.write(chunk)
 
-async def read_file_as_bytes(file_path: str) -> bytes:
-    """Read file content as bytes"""
-    async with aiofiles.open(file_path, "rb") as file:
-        return await file.read()
+    return str(file_path)
 
 async def cleanup_temp_files(job_id: str):
     """Remove temporary files after processing"""
+    # Imported here because ffmpeg_handler imports this module at load time
+    from app.ffmpeg_handler import purge_probe_cache
+
     job_dir = TEMP_DIR / job_id
     if job_dir.exists():
+        purge_probe_cache(str(job_dir))
         shutil.rmtree(job_dir)
 
 def get_video_output_path(input_path: str, job_id: str) -> str: